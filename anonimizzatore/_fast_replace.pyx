@@ -0,0 +1,42 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""Versione compilata con Cython della sostituzione degli intervalli di testo.
+
+Compilabile sul posto con ``cythonize -i anonimizzatore/_fast_replace.pyx``; se il modulo
+non è compilato, :mod:`anonimizzatore.anonymizer` usa l'equivalente in puro Python.
+"""
+
+from cpython.list cimport PyList_New, PyList_SET_ITEM
+from cpython.ref cimport Py_INCREF
+from cpython.unicode cimport PyUnicode_GET_LENGTH, PyUnicode_Join, PyUnicode_Substring
+
+
+def fast_replace(str text, const int[:] starts, const int[:] ends, list replacements) -> str:
+    """Sostituisce gli intervalli ``[starts[i], ends[i])`` di *text* con ``replacements[i]``.
+
+    Gli intervalli devono essere ordinati e disgiunti.
+    """
+
+    cdef Py_ssize_t count = starts.shape[0]
+    # Gli accessi agli indici non sono controllati: le lunghezze vanno verificate qui
+    if ends.shape[0] != count or len(replacements) != count:
+        raise ValueError(
+            f"Lunghezze non coerenti: {count} inizi, {ends.shape[0]} fini, {len(replacements)} sostituzioni"
+        )
+    cdef Py_ssize_t index
+    cdef Py_ssize_t position = 0
+    cdef object piece
+    cdef list pieces = PyList_New(2 * count + 1)
+
+    for index in range(count):
+        piece = PyUnicode_Substring(text, position, starts[index])
+        Py_INCREF(piece)
+        PyList_SET_ITEM(pieces, 2 * index, piece)
+        piece = replacements[index]
+        Py_INCREF(piece)
+        PyList_SET_ITEM(pieces, 2 * index + 1, piece)
+        position = ends[index]
+
+    piece = PyUnicode_Substring(text, position, PyUnicode_GET_LENGTH(text))
+    Py_INCREF(piece)
+    PyList_SET_ITEM(pieces, 2 * count, piece)
+    return PyUnicode_Join("", pieces)
@@ -2,13 +2,32 @@
 
 from __future__ import annotations
 
+import hashlib
 import importlib.util
-from dataclasses import dataclass
-from typing import Dict, Iterable, List, Mapping, MutableMapping, Optional, Sequence
-
-from presidio_analyzer import AnalyzerEngine, RecognizerRegistry, RecognizerResult
-from presidio_analyzer.nlp_engine import NlpEngineProvider
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Final, FrozenSet, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+# Le librerie BLAS usate da spaCy/Thinc avviano per default un thread per core a ogni
+# inferenza; sommati ai thread di Streamlit e ai processi di analyze_texts, i core
+# risulterebbero sovraccarichi. Va impostato prima di importare spaCy; i valori già
+# presenti nell'ambiente hanno la precedenza.
+for _variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(_variable, "1")
+
+import msgspec
+import spacy
+from presidio_analyzer import AnalyzerEngine, BatchAnalyzerEngine, RecognizerRegistry, RecognizerResult
+from presidio_analyzer.nlp_engine import NlpEngine, SpacyNlpEngine
 from presidio_anonymizer import AnonymizerEngine
+from presidio_anonymizer.entities import OperatorConfig
+from thinc.api import CupyOps, get_current_ops
 
 # Mappa lingua -> modello spaCy raccomandato
 _SPACY_MODELS: Mapping[str, str] = {
@@ -16,11 +35,162 @@ _SPACY_MODELS: Mapping[str, str] = {
     "it": "it_core_news_sm",
 }
 
-
+# Mappa entità -> valore sostitutivo di default; "DEFAULT" vale per le entità non elencate
+_DEFAULT_REPLACEMENTS: Final[Mapping[str, str]] = MappingProxyType(
+    {
+        "DEFAULT": "<ANONIMO>",
+        "PERSON": "<PERSONA>",
+        "LOCATION": "<LOCALITÀ>",
+        "EMAIL_ADDRESS": "<EMAIL>",
+        "PHONE_NUMBER": "<TELEFONO>",
+        "DATE_TIME": "<DATA>",
+        "IBAN_CODE": "<IBAN>",
+        "CREDIT_CARD": "<CARTA>",
+        "NRP": "<DOCUMENTO>",
+    }
+)
+
+# Righe vuote (eventualmente con spazi) che separano i paragrafi di un documento
+_SEGMENT_SEPARATOR = re.compile(r"\n[ \t]*\n\s*")
+
+# Numero di paragrafi passati insieme a ``nlp.pipe`` durante l'analisi di un documento
+_SEGMENT_BATCH_SIZE = 32
+# Su GPU conviene usare batch più grandi per mantenere il dispositivo occupato
+_GPU_SEGMENT_BATCH_SIZE = 64
+
+# Numero massimo di analisi memorizzate da ogni istanza di PresidioAnonymizer
+_ANALYSIS_CACHE_SIZE = 128
+
+# Separatore di soli spazi tra due entità dello stesso tipo, che Presidio unisce in una sola.
+# Replica ``re.search(r"^( )+$", ...)`` di Presidio, dove ``$`` accetta anche un "\n" finale.
+_SPACES_ONLY = re.compile(r" +\n?")
+
+# Componenti delle pipeline spaCy non necessari al riconoscimento. Tagger, morphologizer,
+# attribute_ruler e lemmatizer restano attivi: producono i lemmi con cui Presidio alza il
+# punteggio delle entità vicine alle parole di contesto (ad esempio "phone").
+_UNUSED_SPACY_COMPONENTS = ("parser", "senter")
+
+_AnalysisCacheKey = Tuple[str, str, Optional[Tuple[str, ...]]]
+
+
+@lru_cache(maxsize=None)
 def _is_spacy_model_available(model_name: str) -> bool:
     """Restituisce True se il modello spaCy indicato è installato."""
 
-    return importlib.util.find_spec(model_name) is not None
+    return model_name in spacy.util.get_installed_models() or importlib.util.find_spec(model_name) is not None
+
+
+# Modelli di _SPACY_MODELS effettivamente installati, calcolati una sola volta all'import
+_AVAILABLE_MODELS: Mapping[str, str] = {
+    language: model for language, model in _SPACY_MODELS.items() if _is_spacy_model_available(model)
+}
+
+
+def _copy_results(results: Iterable[RecognizerResult]) -> List[RecognizerResult]:
+    """Copia i risultati dell'analisi, così che i chiamanti non alterino quelli in cache."""
+
+    return [
+        RecognizerResult(
+            result.entity_type,
+            result.start,
+            result.end,
+            result.score,
+            result.analysis_explanation,
+            result.recognition_metadata,
+        )
+        for result in results
+    ]
+
+
+def _splice_py(text: str, starts: Sequence[int], ends: Sequence[int], replacements: Sequence[str]) -> str:
+    """Sostituisce gli intervalli ``[starts[i], ends[i])`` di *text* con ``replacements[i]``.
+
+    Gli intervalli devono essere ordinati e disgiunti.
+    """
+
+    pieces: List[str] = []
+    position = 0
+    for start, end, replacement in zip(starts, ends, replacements):
+        pieces.append(text[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+
+try:
+    from ._fast_replace import fast_replace as _splice
+except ImportError:  # estensione Cython non compilata
+    _splice = _splice_py
+
+
+class _CpuSpacyNlpEngine(SpacyNlpEngine):
+    """Engine spaCy di Presidio che non attiva la GPU nemmeno quando rileva CUDA."""
+
+    def _enable_gpu(self) -> None:
+        pass
+
+
+def _create_spacy_engine(use_gpu: bool) -> NlpEngine:
+    """Crea l'engine NLP di Presidio con i modelli spaCy installati, limitati al NER."""
+
+    if not _AVAILABLE_MODELS:
+        supported = ", ".join(f"{lang} ({model})" for lang, model in _SPACY_MODELS.items())
+        raise RuntimeError(
+            "Nessun modello spaCy disponibile. Installa almeno uno dei modelli richiesti, ad esempio con\\n"
+            f"  python -m spacy download en_core_web_sm\\n"
+            f"Modelli supportati: {supported}"
+        )
+
+    models = [{"lang_code": language, "model_name": model} for language, model in _AVAILABLE_MODELS.items()]
+    if use_gpu:
+        spacy.prefer_gpu()
+        nlp_engine: SpacyNlpEngine = SpacyNlpEngine(models=models)
+    else:
+        # Annulla un eventuale prefer_gpu() precedente nello stesso processo
+        spacy.require_cpu()
+        nlp_engine = _CpuSpacyNlpEngine(models=models)
+    nlp_engine.load()
+    for nlp in nlp_engine.nlp.values():
+        nlp.select_pipes(disable=[name for name in _UNUSED_SPACY_COMPONENTS if name in nlp.pipe_names])
+    return nlp_engine
+
+
+@lru_cache(maxsize=4)
+def _build_operators(replacements: FrozenSet[Tuple[str, str]]) -> Mapping[str, OperatorConfig]:
+    """Costruisce gli operatori di sostituzione di Presidio per la mappatura indicata.
+
+    Il risultato è condiviso dalla cache: viene quindi restituito in sola lettura.
+    """
+
+    return MappingProxyType({entity: OperatorConfig("replace", {"new_value": value}) for entity, value in replacements})
+
+
+@dataclass
+class AnonymizationItems:
+    """Sostituzioni effettuate, memorizzate come colonne parallele.
+
+    L'elemento *i* di ciascuna lista descrive la stessa sostituzione; le posizioni
+    si riferiscono al testo anonimizzato e sono in ordine crescente.
+    """
+
+    starts: List[int] = field(default_factory=list)
+    ends: List[int] = field(default_factory=list)
+    entity_types: List[str] = field(default_factory=list)
+    new_values: List[str] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+
+class RecognizerResultRecord(msgspec.Struct):
+    """Risultato dell'analisi serializzato per il frontend."""
+
+    entity_type: str
+    start: int
+    end: int
+    score: float
+    analysis_explanation: Optional[dict] = None
 
 
 @dataclass
@@ -28,37 +198,49 @@ class AnonymizationResult:
     """Risultato dell'operazione di anonimizzazione."""
 
     text: str
-    items: List[dict]
+    items: AnonymizationItems
 
 
 class PresidioAnonymizer:
     """Wrapper di alto livello attorno agli engine di Presidio."""
 
-    def __init__(self) -> None:
-        nlp_configuration = {"nlp_engine_name": "spacy", "models": []}
-        available_languages: List[str] = []
-
-        for language, model in _SPACY_MODELS.items():
-            if _is_spacy_model_available(model):
-                nlp_configuration["models"].append({"lang_code": language, "model_name": model})
-                available_languages.append(language)
-
-        if not nlp_configuration["models"]:
-            supported = ", ".join(f"{lang} ({model})" for lang, model in _SPACY_MODELS.items())
-            raise RuntimeError(
-                "Nessun modello spaCy disponibile. Installa almeno uno dei modelli richiesti, ad esempio con\\n"
-                f"  python -m spacy download en_core_web_sm\\n"
-                f"Modelli supportati: {supported}"
-            )
+    # Operatori per le sostituzioni di default, condivisi da tutte le chiamate senza personalizzazioni
+    _DEFAULT_OPERATORS: Mapping[str, OperatorConfig] = _build_operators(frozenset(_DEFAULT_REPLACEMENTS.items()))
+
+    def __init__(self, use_gpu: bool = True, nlp_engine: Optional[NlpEngine] = None) -> None:
+        """Inizializza gli engine di Presidio con i modelli spaCy installati o con *nlp_engine*.
+
+        Se si passa *nlp_engine*, *use_gpu* viene ignorato.
+        """
 
-        nlp_engine = NlpEngineProvider(nlp_configuration=nlp_configuration).create_engine()
-        registry = RecognizerRegistry()
-        registry.load_predefined_recognizers(nlp_engine=nlp_engine)
+        if nlp_engine is None:
+            nlp_engine = _create_spacy_engine(use_gpu)
+        elif not nlp_engine.is_loaded():
+            nlp_engine.load()
 
-        self._analyzer = AnalyzerEngine(nlp_engine=nlp_engine, registry=registry)
+        # Il dispositivo effettivo può dipendere anche da Presidio: lo si ricava dalle ops di Thinc
+        gpu_enabled = isinstance(get_current_ops(), CupyOps)
+
+        available_languages = list(nlp_engine.get_supported_languages())
+        registry = RecognizerRegistry(supported_languages=available_languages)
+        registry.load_predefined_recognizers(languages=available_languages, nlp_engine=nlp_engine)
+
+        self._nlp_engine = nlp_engine
+        self._segment_batch_size = _GPU_SEGMENT_BATCH_SIZE if gpu_enabled else _SEGMENT_BATCH_SIZE
+        self._analyzer = AnalyzerEngine(
+            nlp_engine=nlp_engine, registry=registry, supported_languages=available_languages
+        )
+        self._batch_analyzer: Optional[BatchAnalyzerEngine] = None
+        self._analysis_cache: "OrderedDict[_AnalysisCacheKey, List[RecognizerResult]]" = OrderedDict()
+        self._analysis_cache_lock = threading.Lock()
         self._anonymizer = AnonymizerEngine()
         self._languages = available_languages
 
+        # Un'analisi a vuoto per lingua carica tabelle e recognizer pigri di spaCy/Presidio,
+        # così la prima richiesta reale non paga il costo di avvio.
+        for language in self._languages:
+            self._analyzer.analyze(text="warmup", language=language)
+
     @property
     def languages(self) -> Sequence[str]:
         """Lingue supportate dai modelli spaCy disponibili."""
@@ -66,61 +248,226 @@ class PresidioAnonymizer:
         return tuple(self._languages)
 
     @staticmethod
-    def default_entity_replacements() -> Dict[str, str]:
-        """Restituisce una mappatura di default tra entità e valore sostitutivo."""
-
-        return {
-            "DEFAULT": "<ANONIMO>",
-            "PERSON": "<PERSONA>",
-            "LOCATION": "<LOCALITÀ>",
-            "EMAIL_ADDRESS": "<EMAIL>",
-            "PHONE_NUMBER": "<TELEFONO>",
-            "DATE_TIME": "<DATA>",
-            "IBAN_CODE": "<IBAN>",
-            "CREDIT_CARD": "<CARTA>",
-            "NRP": "<DOCUMENTO>",
-        }
-
-    def analyze_text(self, text: str, language: str) -> List[RecognizerResult]:
-        """Esegue l'analisi delle entità sensibili in *text* nella lingua indicata."""
+    def default_entity_replacements() -> Mapping[str, str]:
+        """Restituisce la mappatura di default (in sola lettura) tra entità e valore sostitutivo."""
 
-        if not text.strip():
-            return []
+        return _DEFAULT_REPLACEMENTS
 
+    def _check_language(self, language: str) -> None:
         if language not in self._languages:
             available = ", ".join(self._languages)
             raise ValueError(f"Lingua '{language}' non supportata. Lingue disponibili: {available}")
 
-        return self._analyzer.analyze(text=text, language=language)
+    @staticmethod
+    def _segment(text: str) -> List[Tuple[int, str]]:
+        """Divide *text* in paragrafi restituendo coppie (offset, paragrafo)."""
+
+        segments: List[Tuple[int, str]] = []
+        start = 0
+        for match in _SEGMENT_SEPARATOR.finditer(text):
+            segments.append((start, text[start : match.start()]))
+            start = match.end()
+        segments.append((start, text[start:]))
+        return segments
+
+    def analyze_text(
+        self, text: str, language: str, entities: Optional[Sequence[str]] = None
+    ) -> List[RecognizerResult]:
+        """Esegue l'analisi delle entità sensibili in *text* nella lingua indicata.
+
+        Il testo viene diviso in paragrafi che spaCy elabora in batch con ``nlp.pipe``;
+        i recognizer di Presidio riutilizzano poi gli artefatti NLP già calcolati.
+        Se *entities* è indicato, vengono cercate solo le entità elencate e Presidio
+        esegue soltanto i recognizer che le supportano. I risultati
+        delle analisi più recenti vengono riutilizzati quando testo, lingua ed entità
+        coincidono; ogni chiamata riceve comunque oggetti propri.
+        """
+
+        if not text.strip():
+            return []
+
+        self._check_language(language)
+
+        cache_key: _AnalysisCacheKey = (
+            hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest(),
+            language,
+            tuple(sorted(entities)) if entities is not None else None,
+        )
+        with self._analysis_cache_lock:
+            cached = self._analysis_cache.get(cache_key)
+            if cached is not None:
+                self._analysis_cache.move_to_end(cache_key)
+                return _copy_results(cached)
+
+        segments = [(offset, segment) for offset, segment in self._segment(text) if segment.strip()]
+        nlp_artifacts_batch = self._nlp_engine.process_batch(
+            [segment for _, segment in segments], language=language, batch_size=self._segment_batch_size
+        )
+
+        # Riporta le posizioni relative al paragrafo a quelle del testo completo
+        recognizer_results: List[RecognizerResult] = []
+        for (offset, segment), (_, nlp_artifacts) in zip(segments, nlp_artifacts_batch):
+            analyzed = self._analyzer.analyze(
+                text=segment,
+                language=language,
+                entities=list(entities) if entities is not None else None,
+                nlp_artifacts=nlp_artifacts,
+            )
+            for result in analyzed:
+                result.start += offset
+                result.end += offset
+                recognizer_results.append(result)
+
+        with self._analysis_cache_lock:
+            self._analysis_cache[cache_key] = _copy_results(recognizer_results)
+            if len(self._analysis_cache) > _ANALYSIS_CACHE_SIZE:
+                self._analysis_cache.popitem(last=False)
+        return recognizer_results
+
+    def analyze_texts(
+        self,
+        texts: Iterable[str],
+        language: str,
+        batch_size: int = 16,
+        n_process: Optional[int] = None,
+    ) -> List[List[RecognizerResult]]:
+        """Analizza più testi in un'unica passata della pipeline spaCy.
+
+        I testi vengono elaborati a blocchi di *batch_size* documenti e, se *n_process*
+        è maggiore di 1, distribuiti su più processi. Per default viene usato un processo
+        per ogni CPU disponibile. Il risultato mantiene l'ordine dei testi in ingresso.
+        """
+
+        texts = list(texts)
+        if not any(text.strip() for text in texts):
+            return [[] for _ in texts]
+
+        self._check_language(language)
+
+        if self._batch_analyzer is None:
+            self._batch_analyzer = BatchAnalyzerEngine(analyzer_engine=self._analyzer)
+
+        # I testi vuoti non vengono inviati alla pipeline: il loro risultato è sempre vuoto.
+        indexes = [index for index, text in enumerate(texts) if text.strip()]
+        analyzed = self._batch_analyzer.analyze_iterator(
+            [texts[index] for index in indexes],
+            language=language,
+            batch_size=batch_size,
+            n_process=n_process or os.cpu_count() or 1,
+        )
+
+        results: List[List[RecognizerResult]] = [[] for _ in texts]
+        for index, recognizer_results in zip(indexes, analyzed):
+            results[index] = recognizer_results
+        return results
+
+    @staticmethod
+    def _fast_replace(
+        text: str, recognizer_results: Sequence[RecognizerResult], operators: Mapping[str, OperatorConfig]
+    ) -> Optional[AnonymizationResult]:
+        """Sostituisce le entità con valori fissi in un'unica passata sul testo.
+
+        Restituisce None quando serve la logica completa di Presidio: operatori diversi
+        da ``replace``, entità sovrapposte oppure entità dello stesso tipo separate da soli
+        spazi, che Presidio unisce prima della sostituzione.
+        """
+
+        if any(operator.operator_name != "replace" for operator in operators.values()):
+            return None
+
+        starts = array("i")
+        ends = array("i")
+        items = AnonymizationItems()
+        position = 0
+        output_length = 0
+        previous: Optional[RecognizerResult] = None
+        for result in sorted(recognizer_results, key=lambda r: (r.start, r.end)):
+            if previous is not None and (
+                result.start < previous.end
+                or (
+                    result.entity_type == previous.entity_type
+                    and _SPACES_ONLY.fullmatch(text, previous.end, result.start)
+                )
+            ):
+                return None
+
+            operator = operators.get(result.entity_type) or operators["DEFAULT"]
+            # Come l'operatore "replace" di Presidio, un valore vuoto diventa <ENTITY_TYPE>
+            new_value = operator.params.get("new_value") or f"<{result.entity_type}>"
+
+            starts.append(result.start)
+            ends.append(result.end)
+            output_length += result.start - position
+            items.starts.append(output_length)
+            output_length += len(new_value)
+            items.ends.append(output_length)
+            items.entity_types.append(result.entity_type)
+            items.new_values.append(new_value)
+
+            position = result.end
+            previous = result
+
+        return AnonymizationResult(text=_splice(text, starts, ends, items.new_values), items=items)
 
     def anonymize_text(
         self,
         text: str,
-        recognizer_results: Iterable[RecognizerResult],
+        recognizer_results: Sequence[RecognizerResult],
         entity_replacements: Optional[Mapping[str, str]] = None,
         default_value: Optional[str] = None,
     ) -> AnonymizationResult:
         """Anonimizza il testo originale usando i risultati di analisi forniti."""
 
-        replacements = dict(self.default_entity_replacements())
-        if entity_replacements:
-            replacements.update({k: v for k, v in entity_replacements.items() if v})
-        if default_value:
-            replacements["DEFAULT"] = default_value
-
-        operators: Dict[str, MutableMapping[str, str]] = {
-            entity: {"type": "replace", "new_value": value} for entity, value in replacements.items()
-        }
-
+        operators = self._DEFAULT_OPERATORS
+        if entity_replacements or default_value:
+            replacements = dict(self.default_entity_replacements())
+            if entity_replacements:
+                replacements.update({k: v for k, v in entity_replacements.items() if v})
+            if default_value:
+                replacements["DEFAULT"] = default_value
+            operators = _build_operators(frozenset(replacements.items()))
+
+        fast_result = self._fast_replace(text, recognizer_results, operators)
+        if fast_result is not None:
+            return fast_result
+
+        # Presidio copia già i risultati ricevuti, ma può aggiungere "DEFAULT" agli operatori:
+        # gli si passa una copia di quelli condivisi
         anonymized_result = self._anonymizer.anonymize(
-            text=text, analyzer_results=list(recognizer_results), operators=operators
+            text=text, analyzer_results=recognizer_results, operators=dict(operators)
         )
 
-        items = [item.to_dict() for item in anonymized_result.items] if anonymized_result.items else []
+        # Presidio elenca le sostituzioni dalla fine del testo: si usa lo stesso ordine del percorso rapido
+        items = AnonymizationItems()
+        for item in sorted(anonymized_result.items, key=lambda item: item.start):
+            items.starts.append(item.start)
+            items.ends.append(item.end)
+            items.entity_types.append(item.entity_type)
+            items.new_values.append(item.text)
         return AnonymizationResult(text=anonymized_result.text, items=items)
 
+    def run(
+        self,
+        text: str,
+        language: str,
+        replacements: Optional[Mapping[str, str]] = None,
+        entities: Optional[Sequence[str]] = None,
+    ) -> Tuple[AnonymizationResult, List[RecognizerResult]]:
+        """Analizza e anonimizza *text* in un'unica chiamata.
+
+        *replacements* può contenere anche la chiave ``DEFAULT`` per il valore generico;
+        *entities* limita l'analisi alle entità indicate.
+        Restituisce il risultato dell'anonimizzazione e i risultati dell'analisi.
+        """
+
+        recognizer_results = self.analyze_text(text, language, entities=entities)
+        anonymization = self.anonymize_text(text, recognizer_results, entity_replacements=replacements)
+        return anonymization, recognizer_results
+
     @staticmethod
-    def serialize_recognizer_results(results: Iterable[RecognizerResult]) -> List[dict]:
+    def serialize_recognizer_results(results: Sequence[RecognizerResult]) -> List[RecognizerResultRecord]:
         """Serializza i risultati dell'analisi in un formato pronto per il frontend."""
 
-        return [result.to_dict() for result in results]
+        return [
+            RecognizerResultRecord(result.entity_type, result.start, result.end, result.score) for result in results
+        ]
@@ -2,14 +2,27 @@
 
 from __future__ import annotations
 
-from typing import Dict
+import asyncio
+from typing import Dict, List, Mapping, Optional, Tuple
 
+# Importato prima di pandas e streamlit perché limita i thread BLAS prima che NumPy venga caricato
+from anonimizzatore import PresidioAnonymizer
+from anonimizzatore.anonymizer import AnonymizationItems, AnonymizationResult, RecognizerResultRecord
+
+import msgspec
+import pandas as pd
 import streamlit as st
 
-from anonimizzatore import PresidioAnonymizer
+# Oltre questa lunghezza il testo anonimizzato viene mostrato senza evidenziazione della sintassi,
+# che nel browser diventa lenta sui documenti lunghi
+_CODE_RENDER_LIMIT = 4096
 
+# Secondi per cui il server conserva un testo anonimizzato: la cache è condivisa tra le sessioni,
+# quindi va tenuta breve per non trattenere dati sensibili sfuggiti all'analisi
+_ANONYMIZATION_CACHE_TTL = 60
 
-@st.cache_resource(show_spinner=True)
+
+@st.cache_resource(show_spinner="Caricamento dei modelli linguistici (può richiedere qualche secondo)...")
 def get_anonymizer() -> PresidioAnonymizer:
     """Crea un'unica istanza condivisa di :class:`PresidioAnonymizer`."""
 
@@ -24,6 +37,40 @@ def _language_label(language_code: str) -> str:
     return labels.get(language_code, language_code)
 
 
+async def _process(
+    anonymizer: PresidioAnonymizer,
+    text: str,
+    language: str,
+    replacements: Mapping[str, str],
+    entities: Optional[List[str]],
+) -> Tuple[AnonymizationResult, List[RecognizerResultRecord]]:
+    """Analizza *text* in un thread separato, poi anonimizza e serializza i risultati in parallelo."""
+
+    recognizer_results = await asyncio.to_thread(anonymizer.analyze_text, text, language, entities)
+    anonymization, analysis_results = await asyncio.gather(
+        asyncio.to_thread(anonymizer.anonymize_text, text, recognizer_results, replacements),
+        asyncio.to_thread(PresidioAnonymizer.serialize_recognizer_results, recognizer_results),
+    )
+    return anonymization, analysis_results
+
+
+@st.cache_data(max_entries=32, ttl=_ANONYMIZATION_CACHE_TTL, show_spinner=False)
+def _cached_anonymize(
+    text: str,
+    language: str,
+    replacement_items: Tuple[Tuple[str, str], ...],
+    entities: Optional[Tuple[str, ...]],
+) -> Tuple[AnonymizationResult, List[RecognizerResultRecord]]:
+    """Esegue :func:`_process` riutilizzando il risultato quando il form viene reinviato invariato.
+
+    Le sostituzioni arrivano come tupla ordinata di coppie perché i dizionari non sono hashabili.
+    """
+
+    return asyncio.run(
+        _process(get_anonymizer(), text, language, dict(replacement_items), list(entities) if entities else None)
+    )
+
+
 def main() -> None:
     st.set_page_config(page_title="Anonimizzatore Presidio", page_icon="🛡️", layout="wide")
 
@@ -67,15 +114,24 @@ def main() -> None:
                 value=default_replacements.get("DEFAULT", "<ANONIMO>"),
                 help="Usato per tutte le entità che non dispongono di una personalizzazione specifica.",
             )
-            custom_replacements: Dict[str, str] = {}
-            for entity, placeholder in default_replacements.items():
-                if entity == "DEFAULT":
-                    continue
-                custom_replacements[entity] = st.text_input(
-                    f"Sostituzione per {entity}",
-                    value=placeholder,
-                    key=f"replacement_{entity}",
-                )
+            entities = [entity for entity in default_replacements if entity != "DEFAULT"]
+            edited_replacements = st.data_editor(
+                pd.DataFrame(
+                    {"entity": entities, "placeholder": [default_replacements[entity] for entity in entities]}
+                ),
+                num_rows="fixed",
+                disabled=["entity"],
+                hide_index=True,
+                column_config={"entity": "Entità", "placeholder": "Sostituzione"},
+                use_container_width=True,
+                key="replacements_editor",
+            )
+            only_listed_entities = st.checkbox(
+                "Cerca solo le entità elencate",
+                value=False,
+                help="Velocizza l'analisi escludendo i riconoscitori delle altre entità, "
+                "che in questo caso non vengono anonimizzate.",
+            )
 
         submitted = st.form_submit_button("Analizza e anonimizza")
 
@@ -84,36 +140,60 @@ def main() -> None:
             st.warning("Inserisci del testo prima di procedere.")
             return
 
+        custom_replacements: Dict[str, str] = dict(
+            zip(edited_replacements["entity"], edited_replacements["placeholder"])
+        )
+        # Solo i valori modificati dall'utente: senza modifiche si usano gli operatori di default
+        replacements = {
+            entity: value
+            for entity, value in {**custom_replacements, "DEFAULT": default_value}.items()
+            if value != default_replacements.get(entity)
+        }
+
         with st.spinner("Analisi del testo in corso..."):
-            recognizer_results = anonymizer.analyze_text(text=text_to_process, language=language)
-            anonymization = anonymizer.anonymize_text(
-                text=text_to_process,
-                recognizer_results=recognizer_results,
-                entity_replacements=custom_replacements,
-                default_value=default_value,
+            anonymization, analysis_results = _cached_anonymize(
+                text_to_process,
+                language,
+                tuple(sorted(replacements.items())),
+                tuple(custom_replacements) if only_listed_entities else None,
             )
 
-        st.session_state["analysis_results"] = PresidioAnonymizer.serialize_recognizer_results(recognizer_results)
+        st.session_state["analysis_results"] = analysis_results
         st.session_state["anonymized_text"] = anonymization.text
         st.session_state["anonymized_items"] = anonymization.items
 
     if "analysis_results" in st.session_state:
         analysis_results = st.session_state.get("analysis_results", [])
         anonymized_text = st.session_state.get("anonymized_text", "")
-        anonymized_items = st.session_state.get("anonymized_items", [])
+        anonymized_items = st.session_state.get("anonymized_items", AnonymizationItems())
 
         st.subheader("Risultati dell'analisi")
         if analysis_results:
-            st.dataframe(analysis_results, use_container_width=True)
+            st.dataframe(pd.DataFrame.from_records(msgspec.to_builtins(analysis_results)), use_container_width=True)
         else:
             st.info("Nessuna entità sensibile rilevata nel testo fornito.")
 
         st.subheader("Testo anonimizzato")
-        st.code(anonymized_text, language="markdown")
+        if len(anonymized_text) > _CODE_RENDER_LIMIT:
+            st.text_area(
+                "Testo anonimizzato", anonymized_text, height=400, disabled=True, label_visibility="collapsed"
+            )
+        else:
+            st.code(anonymized_text, language="markdown")
 
         if anonymized_items:
             st.subheader("Dettagli delle sostituzioni")
-            st.json(anonymized_items)
+            st.dataframe(
+                pd.DataFrame(
+                    {
+                        "start": anonymized_items.starts,
+                        "end": anonymized_items.ends,
+                        "entity_type": anonymized_items.entity_types,
+                        "new_value": anonymized_items.new_values,
+                    }
+                ),
+                use_container_width=True,
+            )
 
         st.caption(
             "I risultati sono memorizzati localmente nella sessione corrente per consentire confronti rapidi."
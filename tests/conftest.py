@@ -0,0 +1,28 @@
+"""Fixture condivise: un engine spaCy minimale, senza modelli scaricati."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+import spacy
+from presidio_analyzer.nlp_engine import SpacyNlpEngine
+
+from anonimizzatore.anonymizer import PresidioAnonymizer
+
+
+@pytest.fixture(scope="session")
+def spacy_model_path(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    # Pipeline vuota con un entity_ruler che riconosce solo "Mario Rossi"
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "PERSON", "pattern": "Mario Rossi"}])
+    path = tmp_path_factory.mktemp("spacy") / "en_test"
+    nlp.to_disk(path)
+    return path
+
+
+@pytest.fixture
+def anonymizer(spacy_model_path: Path) -> PresidioAnonymizer:
+    nlp_engine = SpacyNlpEngine(models=[{"lang_code": "en", "model_name": str(spacy_model_path)}])
+    return PresidioAnonymizer(nlp_engine=nlp_engine)
@@ -0,0 +1,114 @@
+"""Test di ``PresidioAnonymizer`` con un engine spaCy iniettato."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+import spacy
+from presidio_analyzer.nlp_engine import SpacyNlpEngine, spacy_nlp_engine
+
+from anonimizzatore import anonymizer as anonymizer_module
+from anonimizzatore.anonymizer import PresidioAnonymizer, _CpuSpacyNlpEngine
+
+_NAME = "Mario Rossi"
+
+
+def _person_spans(anonymizer: PresidioAnonymizer, text: str) -> List[Tuple[int, int]]:
+    results = anonymizer.analyze_text(text, "en")
+    return sorted((result.start, result.end) for result in results if result.entity_type == "PERSON")
+
+
+def _expected_spans(text: str) -> List[Tuple[int, int]]:
+    spans = []
+    start = text.find(_NAME)
+    while start != -1:
+        spans.append((start, start + len(_NAME)))
+        start = text.find(_NAME, start + 1)
+    return spans
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Scrive Mario Rossi.\n\nRisponde Mario Rossi.",
+        "Scrive Mario Rossi.\n \n  Risponde Mario Rossi.",
+        "\n\nMario Rossi in apertura.\n\nE di nuovo Mario Rossi.",
+        "Mario Rossi in chiusura.\n\nE di nuovo Mario Rossi.\n \n",
+        "\n \n\tMario Rossi\n\n\n\nMario Rossi\t\n\n",
+    ],
+)
+def test_analyze_text_maps_segment_offsets_to_full_text(anonymizer: PresidioAnonymizer, text: str) -> None:
+    spans = _person_spans(anonymizer, text)
+
+    assert spans == _expected_spans(text)
+    assert all(text[start:end] == _NAME for start, end in spans)
+
+
+def test_analyze_text_matches_single_segment_analysis(anonymizer: PresidioAnonymizer) -> None:
+    paragraphs = ["Scrive Mario Rossi.", "Nessun nome qui.", "Firmato: Mario Rossi"]
+    text = "\n\n".join(paragraphs)
+
+    offset = 0
+    expected = []
+    for paragraph in paragraphs:
+        expected.extend((start + offset, end + offset) for start, end in _person_spans(anonymizer, paragraph))
+        offset += len(paragraph) + 2
+
+    assert _person_spans(anonymizer, text) == expected
+
+
+def test_analyze_text_skips_blank_text(anonymizer: PresidioAnonymizer) -> None:
+    assert anonymizer.analyze_text("\n \n\n", "en") == []
+
+
+@pytest.mark.parametrize("engine_class, expected_calls", [(SpacyNlpEngine, 1), (_CpuSpacyNlpEngine, 0)])
+def test_cpu_engine_ignores_detected_cuda(
+    monkeypatch: pytest.MonkeyPatch, spacy_model_path: Path, engine_class: type, expected_calls: int
+) -> None:
+    calls: List[None] = []
+    monkeypatch.setattr(spacy_nlp_engine.device_detector, "get_device", lambda: "cuda")
+    monkeypatch.setattr(spacy, "require_gpu", lambda *args: calls.append(None))
+
+    nlp_engine = engine_class(models=[{"lang_code": "en", "model_name": str(spacy_model_path)}])
+    nlp_engine.load()
+
+    assert nlp_engine.is_loaded()
+    assert len(calls) == expected_calls
+
+
+def test_cached_results_are_not_shared_with_callers(anonymizer: PresidioAnonymizer) -> None:
+    text = "Scrive Mario Rossi."
+    first = anonymizer.analyze_text(text, "en")
+    expected = [(result.entity_type, result.start, result.end) for result in first]
+    for result in first:
+        result.start = result.end = 0
+    first.clear()
+
+    second = anonymizer.analyze_text(text, "en")
+
+    assert [(result.entity_type, result.start, result.end) for result in second] == expected
+
+
+def test_analysis_cache_evicts_least_recently_used(
+    monkeypatch: pytest.MonkeyPatch, anonymizer: PresidioAnonymizer
+) -> None:
+    monkeypatch.setattr(anonymizer_module, "_ANALYSIS_CACHE_SIZE", 2)
+    for text in ("Primo Mario Rossi.", "Secondo Mario Rossi.", "Terzo Mario Rossi."):
+        anonymizer.analyze_text(text, "en")
+
+    assert len(anonymizer._analysis_cache) == 2
+
+    calls: List[str] = []
+    process_batch = anonymizer._nlp_engine.process_batch
+
+    def counting_process_batch(texts: List[str], **kwargs: object) -> object:
+        calls.extend(texts)
+        return process_batch(texts, **kwargs)
+
+    monkeypatch.setattr(anonymizer._nlp_engine, "process_batch", counting_process_batch)
+    anonymizer.analyze_text("Terzo Mario Rossi.", "en")
+    anonymizer.analyze_text("Primo Mario Rossi.", "en")
+
+    assert calls == ["Primo Mario Rossi."]
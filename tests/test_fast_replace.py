@@ -0,0 +1,139 @@
+"""Equivalenza tra il percorso rapido di sostituzione e ``AnonymizerEngine`` di Presidio."""
+
+from __future__ import annotations
+
+import random
+from array import array
+from types import MappingProxyType
+from typing import List, Mapping, Optional, Tuple
+
+import pytest
+from presidio_analyzer import RecognizerResult
+from presidio_anonymizer import AnonymizerEngine
+from presidio_anonymizer.entities import OperatorConfig
+
+from anonimizzatore.anonymizer import AnonymizationResult, PresidioAnonymizer, _build_operators, _splice_py
+
+_Items = List[Tuple[int, int, str, str]]
+
+
+def _presidio(
+    text: str, results: List[RecognizerResult], operators: Mapping[str, OperatorConfig]
+) -> Tuple[str, _Items]:
+    engine_result = AnonymizerEngine().anonymize(text=text, analyzer_results=results, operators=dict(operators))
+    items = sorted((item.start, item.end, item.entity_type, item.text) for item in engine_result.items)
+    return engine_result.text, items
+
+
+def _fast(
+    text: str, results: List[RecognizerResult], operators: Mapping[str, OperatorConfig]
+) -> Optional[Tuple[str, _Items]]:
+    fast_result: Optional[AnonymizationResult] = PresidioAnonymizer._fast_replace(text, results, operators)
+    if fast_result is None:
+        return None
+    items = fast_result.items
+    return fast_result.text, list(zip(items.starts, items.ends, items.entity_types, items.new_values))
+
+
+def test_disjoint_entities_match_presidio() -> None:
+    text = "Mario Rossi scrive a mario@example.com da Roma."
+    results = [
+        RecognizerResult("EMAIL_ADDRESS", 21, 38, 1.0),
+        RecognizerResult("PERSON", 0, 11, 0.85),
+        RecognizerResult("LOCATION", 42, 46, 0.85),
+    ]
+    operators = PresidioAnonymizer._DEFAULT_OPERATORS
+
+    assert _fast(text, results, operators) == _presidio(text, results, operators)
+
+
+def test_custom_and_empty_replacements_match_presidio() -> None:
+    text = "Chiama Mario al 333 1234567 entro il 3 maggio."
+    results = [
+        RecognizerResult("PERSON", 7, 12, 0.85),
+        RecognizerResult("PHONE_NUMBER", 16, 27, 0.4),
+        RecognizerResult("DATE_TIME", 37, 45, 0.85),
+    ]
+    operators = _build_operators(frozenset({"DEFAULT": "<X>", "PERSON": "", "PHONE_NUMBER": "[tel]"}.items()))
+
+    assert _fast(text, results, operators) == _presidio(text, results, operators)
+
+
+def test_same_type_entities_separated_by_spaces_fall_back() -> None:
+    # Presidio unisce entità dello stesso tipo separate da soli spazi, anche seguiti da un "\n"
+    for text in ("Mario   Rossi", "Mario \nRossi"):
+        results = [
+            RecognizerResult("PERSON", 0, 5, 0.85),
+            RecognizerResult("PERSON", len(text) - 5, len(text), 0.85),
+        ]
+        operators = PresidioAnonymizer._DEFAULT_OPERATORS
+
+        assert _fast(text, results, operators) is None
+        assert len(_presidio(text, results, operators)[1]) == 1
+
+
+def test_overlapping_entities_fall_back() -> None:
+    text = "mario@example.com"
+    results = [RecognizerResult("EMAIL_ADDRESS", 0, 17, 1.0), RecognizerResult("URL", 6, 17, 0.5)]
+
+    assert _fast(text, results, PresidioAnonymizer._DEFAULT_OPERATORS) is None
+
+
+def test_non_replace_operators_fall_back() -> None:
+    text = "Mario Rossi"
+    results = [RecognizerResult("PERSON", 0, 11, 0.85)]
+    operators = {"DEFAULT": OperatorConfig("redact")}
+
+    assert _fast(text, results, operators) is None
+
+
+def test_random_inputs_match_presidio() -> None:
+    rng = random.Random(20261015)
+    operators = PresidioAnonymizer._DEFAULT_OPERATORS
+    fast_cases = 0
+    for _ in range(2000):
+        text = "".join(rng.choice("ab  cd\n") for _ in range(40))
+        results = []
+        for _ in range(rng.randint(0, 5)):
+            start = rng.randint(0, 38)
+            end = rng.randint(start + 1, 40)
+            entity_type = rng.choice(["PERSON", "EMAIL_ADDRESS", "NRP"])
+            results.append(RecognizerResult(entity_type, start, end, rng.random()))
+
+        fast = _fast(text, results, operators)
+        if fast is None:
+            continue
+        fast_cases += 1
+        assert fast == _presidio(text, results, operators), (text, results)
+
+    assert fast_cases > 0
+
+
+def test_cached_operators_are_read_only() -> None:
+    operators = _build_operators(frozenset({"DEFAULT": "<X>"}.items()))
+
+    assert isinstance(operators, MappingProxyType)
+    with pytest.raises(TypeError):
+        operators["PERSON"] = OperatorConfig("redact")  # type: ignore[index]
+
+
+def test_compiled_splice_matches_python() -> None:
+    fast_replace = pytest.importorskip("anonimizzatore._fast_replace").fast_replace
+    rng = random.Random(20261015)
+    for _ in range(500):
+        text = "".join(rng.choice("abcàè \n") for _ in range(rng.randint(0, 40)))
+        bounds = sorted(rng.sample(range(len(text) + 1), 2 * rng.randint(0, (len(text) + 1) // 2)))
+        starts, ends = bounds[0::2], bounds[1::2]
+        replacements = [rng.choice(["<PERSONA>", "", "<LOCALITÀ>"]) for _ in starts]
+
+        expected = _splice_py(text, starts, ends, replacements)
+        assert fast_replace(text, array("i", starts), array("i", ends), replacements) == expected
+
+
+def test_compiled_splice_rejects_mismatched_lengths() -> None:
+    fast_replace = pytest.importorskip("anonimizzatore._fast_replace").fast_replace
+
+    with pytest.raises(ValueError):
+        fast_replace("Mario Rossi", array("i", [0, 6]), array("i", [5]), ["<A>", "<B>"])
+    with pytest.raises(ValueError):
+        fast_replace("Mario Rossi", array("i", [0]), array("i", [5]), [])